@@ -1,7 +1,11 @@
 import argparse
+import asyncio
+import json
 import os
-import subprocess
-from clang.cindex import Index, CursorKind, Config
+import random
+import re
+import doc_cache
+from clang.cindex import Index, CursorKind, Config, TranslationUnit
 
 # Configure libclang path
 if os.name == 'nt':
@@ -16,52 +20,132 @@ std_types = {
     "uint8_t", "uint16_t", "uint32_t", "uint64_t"
 }
 
+SYMBOL_CACHE_VERSION = 3
+
+# Only top-level declarations are read, so function bodies are skipped; the
+# detailed processing record is what exposes MACRO_DEFINITION cursors
+PARSE_OPTIONS = TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+
+# Kinds whose definitions are pulled into a snippet's context when referenced
+CTX_KINDS = {"typedef_decl", "enum_decl", "macro_definition"}
+# Names of context-kind symbols; rebuilt by extract_symbols
+CTX_NAMES = frozenset()
+WORD_RE = re.compile(r"\w+")
+# Source lines per file, read once and shared by every get_declaration call
+FILE_LINES = {}
+
+def read_lines(path):
+    lines = FILE_LINES.get(path)
+    if lines is None:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = FILE_LINES[path] = f.readlines()
+    return lines
+
 def extract_symbols(files):
-    index = Index.create()
+    index = None
     all_symbols = []
     for filepath in files:
-        tu = index.parse(filepath)
-        for cursor in tu.cursor.get_children():
-            if cursor.location.file and not str(cursor.location.file).startswith("/usr"):
-                if cursor.kind in [CursorKind.FUNCTION_DECL, CursorKind.STRUCT_DECL, CursorKind.TYPEDEF_DECL, CursorKind.ENUM_DECL, CursorKind.MACRO_DEFINITION]:
-                    if cursor.spelling and cursor.spelling not in std_types:
-                        symbol_cache[cursor.spelling] = {
-                            "kind": cursor.kind.name.lower(),
-                            "file": filepath,
-                            "line": cursor.location.line
-                        }
-                        all_symbols.append(cursor.spelling)
+        # Unchanged files (and headers) reuse the symbol table from a previous run
+        key = ["api_doc_tool", SYMBOL_CACHE_VERSION, os.path.abspath(filepath)]
+        entries = doc_cache.load_symbols(key)
+        if entries is None:
+            if index is None:
+                index = Index.create()
+            source_stamp = doc_cache.file_stamp(filepath)
+            tu = index.parse(filepath, options=PARSE_OPTIONS)
+            entries = []
+            for cursor in tu.cursor.get_children():
+                if cursor.location.file and not str(cursor.location.file).startswith("/usr"):
+                    if cursor.kind in [CursorKind.FUNCTION_DECL, CursorKind.STRUCT_DECL, CursorKind.TYPEDEF_DECL, CursorKind.ENUM_DECL, CursorKind.MACRO_DEFINITION]:
+                        if cursor.spelling and cursor.spelling not in std_types:
+                            # Declarations from included headers point at the header, not `filepath`
+                            entries.append([cursor.spelling, cursor.kind.name.lower(), cursor.location.file.name, cursor.location.line])
+            doc_cache.store_symbols(key, source_stamp, tu, entries)
+        for name, kind, path, line in entries:
+            symbol_cache[name] = {
+                "kind": kind,
+                "file": path,
+                "line": line
+            }
+            all_symbols.append(name)
+
+    global CTX_NAMES
+    CTX_NAMES = frozenset(name for name, info in symbol_cache.items() if info['kind'] in CTX_KINDS)
     return all_symbols
 
 def get_declaration(symbol):
-    import re
     info = symbol_cache[symbol]
-    with open(info["file"], encoding="utf-8", errors="replace") as f:
-        lines = f.readlines()
+    lines = read_lines(info["file"])
 
     snippet_lines = lines[info["line"] - 1 : info["line"] + 10]
 
     # Include type definitions and macro constants used in the snippet
-    full_context = set()
-    for line in snippet_lines:
-        tokens = re.findall(r"\b\w+\b", line)
-        for token in tokens:
-            if token in symbol_cache and symbol_cache[token]['kind'] in {"typedef_decl", "enum_decl", "macro_definition"}:
-                context_info = symbol_cache[token]
-                with open(context_info["file"], encoding="utf-8", errors="replace") as f2:
-                    ctx_lines = f2.readlines()
-                    def_line = context_info["line"] - 1
-                    full_context.add(''.join(ctx_lines[def_line:def_line+5]).strip())
+    # Ordered so the same snippet always yields the same prompt (and cache key)
+    full_context = {}
+    tokens = (m.group() for m in WORD_RE.finditer(''.join(snippet_lines)))
+    for token in dict.fromkeys(t for t in tokens if t in CTX_NAMES):
+        context_info = symbol_cache[token]
+        ctx_lines = read_lines(context_info["file"])
+        def_line = context_info["line"] - 1
+        full_context[''.join(ctx_lines[def_line:def_line+5]).strip()] = None
 
     snippet = ''.join(snippet_lines).strip()
     return '\n'.join(full_context) + '\n' + snippet
 
+import httpx
 import openai
 
-def run_ollama(symbol, snippet):
-    kind = symbol_cache[symbol]['kind']
-    style = {
-        'function_decl': """Document this C function in detail. Include the name, full parameter list with their types and possible bounds, return type, and a detailed description of what the function does. If observable, also include:
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a precise C documentation generator that only outputs HTML."
+MAX_RETRIES = 5
+# Transient failures worth retrying; APIConnectionError also covers timeouts
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+response_cache = doc_cache.ResponseCache()
+
+def create_client():
+    """
+    Pooled client shared by every request of one generate_all run. Its HTTP
+    pool is bound to the running event loop, so each run creates and closes
+    its own.
+    """
+    return openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        # Retries are handled in request_completion so that they respect the shared rate limits
+        max_retries=0,
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+    )
+
+class AsyncTokenBucket(doc_cache.TokenBucket):
+    """Token bucket whose `acquire` waits until enough tokens are available."""
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        async with self.lock:
+            delay = self.take(amount)
+            while delay:
+                await asyncio.sleep(delay)
+                delay = self.take(amount)
+
+def retry_delay(error, attempt):
+    # Prefer the server's Retry-After hint, otherwise back off exponentially with jitter
+    response = getattr(error, "response", None)
+    if response is not None:
+        for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            value = response.headers.get(header)
+            if value:
+                try:
+                    return float(value) * scale
+                except ValueError:
+                    pass
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+STYLES = {
+    'function_decl': """Document this C function in detail. Include the name, full parameter list with their types and possible bounds, return type, and a detailed description of what the function does. If observable, also include:
 
 - Complexity (e.g. time or space complexity)
 - Side effects (e.g. mutating global state, I/O)
@@ -69,16 +153,36 @@ def run_ollama(symbol, snippet):
 
 Describe parameters and return value using <dl>, with <dt> and <dd> for names and descriptions.""",
 
-        'struct_decl': 'Document this struct including the struct name, each field name, its type, and purpose. Include any observable struct-level invariants or alignment notes.',
+    'struct_decl': 'Document this struct including the struct name, each field name, its type, and purpose. Include any observable struct-level invariants or alignment notes.',
 
-        'typedef_decl': 'Document this typedef. Explain what it abstracts, the underlying type, and how it is typically used.',
+    'typedef_decl': 'Document this typedef. Explain what it abstracts, the underlying type, and how it is typically used.',
 
-        'enum_decl': 'Document this enum type in full detail. List all enumerators with their values and what they represent. Mention where each enumerator might be used if observable. Use a <table> or <dl> for structure.',
+    'enum_decl': 'Document this enum type in full detail. List all enumerators with their values and what they represent. Mention where each enumerator might be used if observable. Use a <table> or <dl> for structure.',
 
-        'macro_definition': 'Document this macro constant. Describe its replacement value and how it is expected to be used. Mention any semantic effect it has on compilation.'
-    }.get(kind, 'Document this C symbol. Structure the description according to its type.')
+    'macro_definition': 'Document this macro constant. Describe its replacement value and how it is expected to be used. Mention any semantic effect it has on compilation.'
+}
+DEFAULT_STYLE = 'Document this C symbol. Structure the description according to its type.'
+
+BATCH_SYSTEM_PROMPT = "You are a precise C documentation generator that outputs a JSON object of HTML documents."
+
+# Expected length of one generated document, and the most a single reply may
+# contain; a batch reply holds one document per symbol
+OUTPUT_TOKENS_PER_SYMBOL = 800
+MAX_COMPLETION_TOKENS = 16384
+MAX_BATCH_SYMBOLS = MAX_COMPLETION_TOKENS // OUTPUT_TOKENS_PER_SYMBOL
+
+def chars_to_tokens(length):
+    # Rough estimate (~4 characters per token), good enough for rate limiting and packing
+    return length // 4 + 1
+
+def estimate_tokens(text):
+    return chars_to_tokens(len(text))
+
+def build_prompt(symbol, snippet):
+    kind = symbol_cache[symbol]['kind']
+    style = STYLES.get(kind, DEFAULT_STYLE)
 
-    prompt = f"""
+    return f"""
 You are an expert technical documentation engine.
 
 You are provided with a C {kind} definition and its relevant context below. {style}
@@ -96,21 +200,203 @@ Output ONLY clean, semantic HTML inside a <section>. Do NOT include markdown, gu
 Do not add anything other than what I've asked for. Do NOT use markdown formatting. Provide raw HTML only.
 """
 
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a precise C documentation generator that only outputs HTML."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.2
+def single_messages(symbol, snippet):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(symbol, snippet)}
+    ]
+
+def batch_style(kind):
+    return f"For a {kind}: {STYLES.get(kind, DEFAULT_STYLE)}"
+
+def batch_item(symbol, snippet):
+    return {"id": symbol, "kind": symbol_cache[symbol]['kind'], "snippet": snippet.strip()}
+
+def build_batch_prompt(entries):
+    kinds = dict.fromkeys(symbol_cache[sym]['kind'] for sym, _ in entries)
+    styles = '\n\n'.join(batch_style(kind) for kind in kinds)
+    items = json.dumps([batch_item(sym, snippet) for sym, snippet in entries], indent=2)
+
+    return f"""
+You are an expert technical documentation engine.
+
+You are provided with a JSON array of C definitions below. Each item has an "id", its "kind" and a "snippet" containing the definition and its relevant context. Document every item separately.
+
+{styles}
+
+<symbols>
+{items}
+</symbols>
+
+Each document must be clean, semantic HTML inside a <section>. Do NOT include markdown, guesses, summaries, or template filler.
+
+✅ Use <h2>, <dl>, <dt>, <dd>, <code>, <p>, etc. for structure.
+✅ Do NOT hallucinate any meaning. Describe only what is explicit in the code.
+✅ Start each document with <section> and end it with </section>.
+
+Reply with a single JSON object mapping every "id" to its HTML document as a string, and nothing else.
+"""
+
+def pack_batches(entries, budget):
+    """
+    Greedily group (symbol, snippet) pairs so each batch request, system
+    prompt and expected reply included, stays within `budget` tokens and
+    holds at most MAX_BATCH_SYMBOLS symbols. A symbol too large to fit
+    alongside any other is given a batch of its own.
+    """
+    # Sizes are summed in characters as build_batch_prompt lays them out, so
+    # the prompt is never rendered more than once
+    base = len(BATCH_SYSTEM_PROMPT) + len(build_batch_prompt([]))
+    batches = []
+    current = []
+    kinds = set()
+    used = base
+    for entry in entries:
+        kind = symbol_cache[entry[0]]['kind']
+        # Inside the array each item line gains two spaces of indent, plus ",\n" between items
+        item = json.dumps(batch_item(*entry), indent=2)
+        item_cost = len(item) + 2 * item.count('\n') + 4
+        # A kind's style paragraph (and its separator) is added once per batch
+        style_cost = 0 if kind in kinds else len(batch_style(kind)) + 2
+        output = (len(current) + 1) * OUTPUT_TOKENS_PER_SYMBOL
+        if current and (len(current) == MAX_BATCH_SYMBOLS or chars_to_tokens(used + style_cost + item_cost) + output > budget):
+            batches.append(current)
+            current = []
+            kinds = set()
+            used = base
+            style_cost = len(batch_style(kind)) + 2
+        current.append(entry)
+        kinds.add(kind)
+        used += style_cost + item_cost
+    if current:
+        batches.append(current)
+    return batches
+
+async def request_completion(client, buckets, messages, expected_output=OUTPUT_TOKENS_PER_SYMBOL, **kwargs):
+    """
+    Send one chat request within the rate limits and return its first choice.
+    The token bucket is charged for the prompt and `expected_output`, as
+    completion tokens count against the same per-minute limit.
+    """
+    estimated_tokens = sum(estimate_tokens(m["content"]) for m in messages) + expected_output
+    for attempt in range(MAX_RETRIES + 1):
+        for bucket, amount in zip(buckets, (1, estimated_tokens)):
+            await bucket.acquire(amount)
+        try:
+            response = await client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.2,
+                **kwargs
+            )
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt))
+        else:
+            return response.choices[0]
+
+async def run_ollama(symbol, snippet, client, buckets=()):
+    messages = single_messages(symbol, snippet)
+    cached = response_cache.get(MODEL, messages)
+    if cached is not None:
+        return cached
+
+    html = (await request_completion(client, buckets, messages)).message.content.strip()
+    response_cache.put(MODEL, messages, html)
+    return html
+
+async def run_ollama_batch(entries, client, buckets=()):
+    """
+    Document several symbols with one request. Returns {symbol: html}; any
+    symbol missing from the reply, or every symbol if the reply was cut off
+    at the completion limit, is documented on its own instead.
+    """
+    if len(entries) == 1:
+        symbol, snippet = entries[0]
+        return {symbol: await run_ollama(symbol, snippet, client, buckets)}
+
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": build_batch_prompt(entries)}
+    ]
+    choice = await request_completion(
+        client, buckets, messages,
+        expected_output=len(entries) * OUTPUT_TOKENS_PER_SYMBOL,
+        max_tokens=MAX_COMPLETION_TOKENS,
+        response_format={"type": "json_object"}
     )
-    return response.choices[0].message.content.strip()
+    try:
+        # A reply cut off at the completion limit is discarded as a whole
+        reply = {} if choice.finish_reason == "length" else json.loads(choice.message.content)
+    except ValueError:
+        reply = {}
+    if not isinstance(reply, dict):
+        reply = {}
+
+    results = {}
+    for symbol, snippet in entries:
+        html = reply.get(symbol)
+        if isinstance(html, str) and html.strip():
+            html = html.strip()
+            # Stored under the single-symbol key so later runs hit the cache either way
+            response_cache.put(MODEL, single_messages(symbol, snippet), html)
+        else:
+            html = await run_ollama(symbol, snippet, client, buckets)
+        results[symbol] = html
+    return results
+
+async def generate_all(targets, max_concurrent=8, rpm=500, tpm=30000, batch_tokens=0):
+    client = create_client()
+    semaphore = asyncio.Semaphore(max_concurrent)
+    buckets = (AsyncTokenBucket(rpm), AsyncTokenBucket(tpm))
+    tasks = {}
+
+    try:
+        entries = [(sym, get_declaration(sym)) for sym in dict.fromkeys(targets)]
+
+        # Symbols whose declaration and prompt are unchanged since they were
+        # last generated reuse that output without calling the model
+        stored = {}
+        for sym, decl in entries:
+            html = response_cache.get(MODEL, single_messages(sym, decl))
+            if html is not None:
+                stored[sym] = html
+        entries = [e for e in entries if e[0] not in stored]
+
+        async def generate(entries):
+            async with semaphore:
+                return await run_ollama_batch(entries, client, buckets)
+
+        if batch_tokens > 0:
+            batches = pack_batches(entries, batch_tokens)
+        else:
+            batches = [[e] for e in entries]
+
+        for batch in batches:
+            task = asyncio.create_task(generate(batch))
+            for sym, _ in batch:
+                tasks[sym] = task
+        # Print in request order, as soon as each result is available
+        for sym in targets:
+            print(stored[sym] if sym in stored else (await tasks[sym])[sym])
+    finally:
+        # Stop outstanding requests before their client is closed
+        pending_tasks = set(tasks.values())
+        for task in pending_tasks:
+            task.cancel()
+        await asyncio.gather(*pending_tasks, return_exceptions=True)
+        await client.close()
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--discover", action="store_true")
     parser.add_argument("--generate", help="Text file containing symbols to generate")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of in-flight OpenAI requests")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=30000, help="Tokens per minute limit")
+    parser.add_argument("--batch-tokens", type=int, default=0, help="Pack several symbols into one request of up to this many tokens, expected output included (0 disables batching)")
+    parser.add_argument("--force", action="store_true", help="Regenerate every symbol, ignoring cached documentation")
     parser.add_argument("files", nargs="+")
     args = parser.parse_args()
 
@@ -122,11 +408,11 @@ def main():
         return
 
     if args.generate:
+        # Cached results are still refreshed with the new output
+        response_cache.refresh = args.force
         with open(args.generate) as f:
             targets = [line.strip() for line in f if line.strip() in symbols]
-        for sym in targets:
-            decl = get_declaration(sym)
-            print(run_ollama(sym, decl))
+        asyncio.run(generate_all(targets, args.concurrency, args.rpm, args.tpm, args.batch_tokens))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# On-disk caches shared by api_doc_tool.py and hdocs.py
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "heuristadocs")
+SYMBOLS_DIR = os.path.join(CACHE_DIR, "symbols")
+RESPONSES_DB = os.path.join(CACHE_DIR, "responses.sqlite")
+
+# clang.cindex.Diagnostic.Error; errors and fatals are at or above it
+DIAGNOSTIC_ERROR = 3
+
+
+def file_stamp(path):
+    """
+    Identify the current version of a file by its absolute path, mtime and size.
+    """
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_mtime_ns, st.st_size]
+
+
+def _symbols_path(key):
+    digest = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+    return os.path.join(SYMBOLS_DIR, digest + ".json")
+
+
+def load_symbols(key):
+    """
+    Return the symbol table cached under `key`, or None if there is no entry
+    or any file the translation unit was parsed from has changed since.
+    """
+    try:
+        with open(_symbols_path(key), encoding="utf-8") as f:
+            entry = json.load(f)
+        for stamp in entry["deps"]:
+            if file_stamp(stamp[0]) != stamp:
+                return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return entry["symbols"]
+
+
+def store_symbols(key, source_stamp, tu, symbols):
+    """
+    Cache the symbol table extracted from `tu`. `source_stamp` must be taken
+    before parsing so an edit made during the parse invalidates the entry.
+    Translation units that parsed with errors are not cached: a missing
+    header is absent from the dependencies, so creating it later would not
+    invalidate the entry.
+    """
+    if any(d.severity >= DIAGNOSTIC_ERROR for d in tu.diagnostics):
+        return
+    path = _symbols_path(key)
+    try:
+        deps = [source_stamp]
+        seen = {source_stamp[0]}
+        for inc in tu.get_includes():
+            stamp = file_stamp(inc.include.name)
+            if stamp[0] not in seen:
+                seen.add(stamp[0])
+                deps.append(stamp)
+        os.makedirs(SYMBOLS_DIR, exist_ok=True)
+        # Write then rename so concurrent readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"deps": deps, "symbols": symbols}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+class TokenBucket:
+    """
+    Refills `capacity` tokens per minute. Subclasses add an `acquire` that
+    holds a lock around `take` and waits for the delay it returns.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.rate = capacity / 60.0
+        self.updated = time.monotonic()
+
+    def take(self, amount=1):
+        """
+        Spend `amount` tokens and return 0, or if too few are available,
+        return the seconds until there will be enough.
+        """
+        amount = min(amount, self.capacity)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+
+class LRUStore:
+    """
+    String key/value store persisted in SQLite and bounded to `size_limit`
+    rows, least recently used evicted first, with an in-process layer of at
+    most as many entries in front. While `refresh` is set, lookups miss but values are still stored.
+    """
+    def __init__(self, path, size_limit=10000):
+        self.path = path
+        self.size_limit = size_limit
+        self.refresh = False
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _db(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        return self.conn
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.size_limit:
+            self.memory.popitem(last=False)
+
+    def lookup(self, key):
+        if self.refresh:
+            return None
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            try:
+                db = self._db()
+                row = db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                with db:
+                    db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            except (OSError, sqlite3.Error):
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def store(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+            try:
+                db = self._db()
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO entries (key, value, last_used) VALUES (?, ?, ?)",
+                        (key, value, time.time())
+                    )
+                    count = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                    if count > self.size_limit:
+                        db.execute(
+                            "DELETE FROM entries WHERE key IN "
+                            "(SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                            (count - self.size_limit,)
+                        )
+            except (OSError, sqlite3.Error):
+                pass
+
+
+class ResponseCache(LRUStore):
+    """
+    LRU cache of model responses, keyed on the SHA-256 of the model name and
+    request messages.
+    """
+    def __init__(self, path=RESPONSES_DB, size_limit=10000):
+        super().__init__(path, size_limit)
+
+    @staticmethod
+    def key(model, messages):
+        return hashlib.sha256(json.dumps([model, messages]).encode("utf-8")).hexdigest()
+
+    def get(self, model, messages):
+        return self.lookup(self.key(model, messages))
+
+    def put(self, model, messages, response):
+        self.store(self.key(model, messages), response)
+
@@ -1,189 +1,259 @@
 import sys
 import os
 import json
+import re
+import string
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import httpx
 import openai
+import doc_cache
 from clang import cindex
 from clang.cindex import CursorKind
 
 # Point to LLVM's libclang
 cindex.Config.set_library_path(r"S:\Program Files\LLVM\bin")
 
-# Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+SYMBOL_CACHE_VERSION = 2
+
+response_cache = doc_cache.ResponseCache()
+
+# Documentation requests in flight at once, and the account's request rate limit
+GENERATION_WORKERS = 8
+REQUESTS_PER_MINUTE = 500
+
+
+class BlockingTokenBucket(doc_cache.TokenBucket):
+    """
+    Token bucket whose `acquire` blocks the calling thread until a token is
+    available.
+    """
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            delay = self.take()
+            while delay:
+                time.sleep(delay)
+                delay = self.take()
+
+
+request_bucket = BlockingTokenBucket(REQUESTS_PER_MINUTE)
+
+# A single libclang index is shared by every parse in this process
+_index = None
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = cindex.Index.create()
+    return _index
+
+
+# One OpenAI client per process, so requests share its HTTP connection pool.
+# Generation workers call get_client concurrently, so creation is locked.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=openai.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+                )
+            )
+        return _client
+
+
+# Pointer/reference markers and qualifiers that do not change which type is named
+STRIP_RE = re.compile(r'\b(?:const|volatile|restrict)\b|[*&]')
+
+
+@functools.lru_cache(maxsize=None)
+def base_type(type_spelling):
+    return STRIP_RE.sub('', type_spelling).strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _is_under(fname, base_abs):
+    return os.path.abspath(fname).startswith(base_abs)
 
 
 def extract_symbols_from_file(source_path, clang_args=None, base_dir=None):
     """
     Parse a C/C++ source file, collect all user-defined symbols and types,
-    and record references between them.
+    and record references between them. Results are cached on disk until the
+    file or any header it includes changes.
     """
-    index = cindex.Index.create()
     if clang_args is None:
         clang_args = []
     base_dir = base_dir or os.path.dirname(os.path.abspath(source_path))
 
+    cache_key = ["hdocs", SYMBOL_CACHE_VERSION, os.path.abspath(source_path), list(clang_args), os.path.abspath(base_dir)]
+    cached = doc_cache.load_symbols(cache_key)
+    if cached is not None:
+        return cached
+
+    index = get_index()
     try:
+        source_stamp = doc_cache.file_stamp(source_path)
         tu = index.parse(source_path, args=clang_args)
     except Exception as e:
         print(f"Error parsing {source_path}: {e}")
         return []
 
+    base_abs = os.path.abspath(base_dir)
+
     def is_user_file(node):
         loc = node.location.file
-        if not loc:
-            return False
-        path = os.path.abspath(loc.name)
-        return path.startswith(os.path.abspath(base_dir))
+        return bool(loc) and _is_under(loc.name, base_abs)
 
-    # First pass: collect type definitions
+    # Type definitions and symbols are collected in a single pass; body type
+    # references are filtered against the definitions once the pass is done
     definitions = set()
-    def collect_defs(node):
-        if node.kind != CursorKind.TRANSLATION_UNIT and not is_user_file(node):
-            return
-        if node.kind in (
-            CursorKind.ENUM_DECL,
-            CursorKind.STRUCT_DECL,
-            CursorKind.CLASS_DECL,
-            CursorKind.UNION_DECL,
-            CursorKind.TYPEDEF_DECL
-        ) and node.spelling:
-            definitions.add(node.spelling)
-        for child in node.get_children():
-            collect_defs(child)
-    collect_defs(tu.cursor)
-
     symbols = []
-    def extract_body_and_refs(func_node):
-        type_refs = set()
+    function_refs = []
+    skip_children = object()
+    # Type spellings are reduced to base types as symbols are extracted, so
+    # enrichment only has to test membership in the definitions
+    candidate_refs = []
+    field_bases = {}
+
+    def add_symbol(symbol, base_types=None, fields=()):
+        bases = [base_type(ftype) for _, ftype in fields]
+        symbols.append(symbol)
+        candidate_refs.append((symbol, bases if base_types is None else base_types))
+        # Last symbol with a name wins, as a lookup by name would
+        field_bases[symbol['name']] = bases
+
+    def handle_function(node):
+        if not node.is_definition():
+            return skip_children
+        parent = node.semantic_parent
+        scope = f"{parent.spelling}::" if parent and parent.spelling else ""
+        name = scope + node.spelling
+        ret_type = node.result_type.spelling
+        parameters = [(arg.spelling, arg.type.spelling) for arg in node.get_arguments()]
         body_tokens = []
-        def gather_refs(node):
-            if node.kind == CursorKind.TYPE_REF and node.spelling in definitions:
-                type_refs.add(node.spelling)
-            for c in node.get_children():
-                gather_refs(c)
-        for child in func_node.get_children():
+        for child in node.get_children():
             if child.kind == CursorKind.COMPOUND_STMT:
                 for tok in child.get_tokens():
                     body_tokens.append(tok.spelling)
-                gather_refs(child)
-        return type_refs, ' '.join(body_tokens)
+        symbol = {
+            'type': 'function',
+            'name': name,
+            'return_type': ret_type,
+            'parameters': parameters,
+            'type_references': [],
+            'body': ' '.join(body_tokens)
+        }
+        add_symbol(symbol, [base_type(ret_type)] + [base_type(ptype) for _, ptype in parameters])
+        body_refs = {}
+        function_refs.append((symbol, body_refs))
+        return body_refs
+
+    def handle_enum(node):
+        enumerators = [c.spelling for c in node.get_children() if c.kind == CursorKind.ENUM_CONSTANT_DECL]
+        add_symbol({'type': 'enum', 'name': node.spelling, 'enumerators': enumerators}, [])
+
+    def handle_struct(node):
+        fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
+        methods = [c.spelling for c in node.get_children() if c.kind == CursorKind.CXX_METHOD and c.is_definition()]
+        add_symbol({'type': 'struct', 'name': node.spelling, 'fields': fields, 'methods': methods}, fields=fields)
+
+    def handle_class(node):
+        fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
+        methods = []
+        for c in node.get_children():
+            if c.kind == CursorKind.CXX_METHOD and c.is_definition():
+                qualifier = f"{c.semantic_parent.spelling}::" if c.semantic_parent and c.semantic_parent.spelling else ""
+                methods.append(qualifier + c.spelling)
+        add_symbol({'type': 'class', 'name': node.spelling, 'fields': fields, 'methods': methods}, fields=fields)
+
+    def handle_union(node):
+        fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
+        add_symbol({'type': 'union', 'name': node.spelling, 'fields': fields}, fields=fields)
+
+    def handle_typedef(node):
+        underlying = node.underlying_typedef_type.spelling
+        add_symbol({'type': 'typedef', 'name': node.spelling, 'underlying': underlying}, [base_type(underlying)])
+
+    dispatch = {
+        CursorKind.FUNCTION_DECL: handle_function,
+        CursorKind.CXX_METHOD: handle_function,
+        CursorKind.ENUM_DECL: handle_enum,
+        CursorKind.STRUCT_DECL: handle_struct,
+        CursorKind.CLASS_DECL: handle_class,
+        CursorKind.UNION_DECL: handle_union,
+        CursorKind.TYPEDEF_DECL: handle_typedef,
+    }
+    definition_kinds = (
+        CursorKind.ENUM_DECL,
+        CursorKind.STRUCT_DECL,
+        CursorKind.CLASS_DECL,
+        CursorKind.UNION_DECL,
+        CursorKind.TYPEDEF_DECL
+    )
 
-    def visit(node):
-        if node.kind != CursorKind.TRANSLATION_UNIT and not is_user_file(node):
-            return
+    # Iterative pre-order walk. An explicit stack is used rather than
+    # walk_preorder() so that subtrees outside base_dir (system headers) are
+    # pruned instead of visited. Each entry carries the reference maps of
+    # the function bodies enclosing the node.
+    stack = [(tu.cursor, ())]
+    while stack:
+        node, enclosing_refs = stack.pop()
         kind = node.kind
-        if kind in (CursorKind.FUNCTION_DECL, CursorKind.CXX_METHOD) and is_user_file(node):
-            if not node.is_definition():
-                return
-            parent = node.semantic_parent
-            scope = f"{parent.spelling}::" if parent and parent.spelling else ""
-            name = scope + node.spelling
-            ret_type = node.result_type.spelling
-            parameters = [(arg.spelling, arg.type.spelling) for arg in node.get_arguments()]
-            body_refs, body = extract_body_and_refs(node)
-            symbols.append({
-                'type': 'function',
-                'name': name,
-                'return_type': ret_type,
-                'parameters': parameters,
-                'type_references': list(body_refs),
-                'body': body
-            })
-        elif kind == CursorKind.ENUM_DECL and is_user_file(node):
-            enumerators = [c.spelling for c in node.get_children() if c.kind == CursorKind.ENUM_CONSTANT_DECL]
-            symbols.append({'type': 'enum', 'name': node.spelling, 'enumerators': enumerators})
-        elif kind == CursorKind.STRUCT_DECL and is_user_file(node):
-            fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
-            methods = [c.spelling for c in node.get_children() if c.kind == CursorKind.CXX_METHOD and c.is_definition()]
-            symbols.append({'type': 'struct', 'name': node.spelling, 'fields': fields, 'methods': methods})
-        elif kind == CursorKind.CLASS_DECL and is_user_file(node):
-            fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
-            methods = []
-            for c in node.get_children():
-                if c.kind == CursorKind.CXX_METHOD and c.is_definition():
-                    qualifier = f"{c.semantic_parent.spelling}::" if c.semantic_parent and c.semantic_parent.spelling else ""
-                    methods.append(qualifier + c.spelling)
-            symbols.append({'type': 'class', 'name': node.spelling, 'fields': fields, 'methods': methods})
-        elif kind == CursorKind.UNION_DECL and is_user_file(node):
-            fields = [(c.spelling, c.type.spelling) for c in node.get_children() if c.kind == CursorKind.FIELD_DECL]
-            symbols.append({'type': 'union', 'name': node.spelling, 'fields': fields})
-        elif kind == CursorKind.TYPEDEF_DECL and is_user_file(node):
-            symbols.append({'type': 'typedef', 'name': node.spelling, 'underlying': node.underlying_typedef_type.spelling})
-        for child in node.get_children():
-            visit(child)
-    visit(tu.cursor)
+        if kind != CursorKind.TRANSLATION_UNIT and not is_user_file(node):
+            continue
+        if kind == CursorKind.TYPE_REF:
+            for refs in enclosing_refs:
+                refs[node.spelling] = None
+        if kind in definition_kinds and node.spelling:
+            definitions.add(node.spelling)
+        handler = dispatch.get(kind)
+        body_refs = handler(node) if handler else None
+        if body_refs is skip_children:
+            continue
+        children = list(node.get_children())
+        for child in reversed(children):
+            if body_refs is not None and child.kind == CursorKind.COMPOUND_STMT:
+                stack.append((child, enclosing_refs + (body_refs,)))
+            else:
+                stack.append((child, enclosing_refs))
+
+    for symbol, body_refs in function_refs:
+        symbol['type_references'] = [ref for ref in body_refs if ref in definitions]
 
     # Enrich references
-    symbol_map_local = {s['name']: s for s in symbols}
-    for s in symbols:
-        if s['type'] == 'function':
-            base_ret = s['return_type'].replace('*', '').replace('&', '').replace('const', '').strip()
-            if base_ret in definitions:
-                s['type_references'].append(base_ret)
-            for _, ptype in s['parameters']:
-                base_p = ptype.replace('*', '').replace('&', '').replace('const', '').strip()
-                if base_p in definitions:
-                    s['type_references'].append(base_p)
-            if '::' in s['name']:
-                cls = s['name'].split('::')[0]
-                parent = symbol_map_local.get(cls)
-                if parent:
-                    for _, ftype in parent.get('fields', []):
-                        base_f = ftype.replace('*', '').replace('&', '').replace('const', '').strip()
-                        if base_f in definitions:
-                            s['type_references'].append(base_f)
-        if s['type'] == 'typedef':
-            base_t = s['underlying'].replace('*', '').replace('&', '').replace('const', '').strip()
-            if base_t in definitions:
-                s.setdefault('type_references', []).append(base_t)
-        if s['type'] in ['struct','class','union']:
-            for _, ftype in s['fields']:
-                base_f = ftype.replace('*', '').replace('&', '').replace('const', '').strip()
-                if base_f in definitions:
-                    s.setdefault('type_references', []).append(base_f)
-        if 'type_references' in s:
-            s['type_references'] = list(dict.fromkeys(s['type_references']))
-
+    for s, bases in candidate_refs:
+        if s['type'] == 'function' and '::' in s['name']:
+            bases = bases + field_bases.get(s['name'].split('::')[0], [])
+        refs = [base for base in bases if base in definitions]
+        if refs or 'type_references' in s:
+            s['type_references'] = list(dict.fromkeys(s.get('type_references', []) + refs))
+
+    doc_cache.store_symbols(cache_key, source_stamp, tu, symbols)
     return symbols
 
 
-def build_prompt_for_symbol(symbol, symbol_map):
-    defs = [symbol]
-    for ref in symbol.get('type_references', []):
-        if ref in symbol_map:
-            defs.append(symbol_map[ref])
-    for field in symbol.get('fields', []):
-        typ = field[1]
-        if typ in symbol_map:
-            defs.append(symbol_map[typ])
-    if symbol['type'] == 'typedef':
-        typ = symbol['underlying']
-        if typ in symbol_map:
-            defs.append(symbol_map[typ])
-    unique_defs = list({d['name']: d for d in defs}.values())
-    defs_json = json.dumps(unique_defs, indent=2)
-
-    anchor_instructions = (
-        "When mentioning any referenced symbol, wrap its name in an anchor tag linking to its definition, "
-        "e.g., <a href=\"#{NAME}\">{NAME}</a>. Ensure each symbol section has an id matching its name."
-    )
-
-    prompt_header = f"""
-You are an expert C and C++ documentation generator using HTML. Produce detailed and informative HTML documentation to the best of your abilities. If you are inferring something, ensure you show that and do not portray it as fact.
-I will provide a JSON structure which provides an overview of the symbol you must write documentation for.
-
-Context definitions (JSON):
-{defs_json}
-
-Symbol: {symbol['name']} ({symbol['type']})
-
-{anchor_instructions}
-
-Use the template below:
-"""
-
-    # Select template based on type
-    if symbol['type'] == 'function':
+@functools.lru_cache(maxsize=None)
+def _render_template(sym_type):
+    """
+    Build the template and footer for a symbol type once. The symbol name
+    is left as $name and substituted per symbol.
+    """
+    if sym_type == 'function':
         template = '''
 <article class="symbol-doc" id="{NAME}">
   <header>
@@ -218,7 +288,7 @@ Use the template below:
   </section>
 </article>
 '''
-    elif symbol['type'] == 'enum':
+    elif sym_type == 'enum':
         template = '''
 <article class="symbol-doc" id="{NAME}">
   <header>
@@ -237,21 +307,21 @@ Use the template below:
   </section>
 </article>
 '''
-    elif symbol['type'] in ('struct', 'class', 'union'):
-        kind = symbol['type'].capitalize()
+    elif sym_type in ('struct', 'class', 'union'):
+        kind = sym_type.capitalize()
         template = f'''
-<article class="symbol-doc" id="{symbol['name']}">
+<article class="symbol-doc" id="$name">
   <header>
-    <h1><a href="#{symbol['name']}">{symbol['name']}</a></h1>
+    <h1><a href="#$name">$name</a></h1>
     <h2>{kind}</h2>
   </header>
-  <section id="{symbol['name']}-fields" class="members">
+  <section id="$name-fields" class="members">
     <h3>Fields</h3>
     <ul>
       {{#FIELDS}}<li><a href="#{{NAME}}"><strong>{{NAME}}</strong></a>: {{TYPE}}</li>{{/FIELDS}}
     </ul>
   </section>
-  <section id="{symbol['name']}-methods" class="methods">
+  <section id="$name-methods" class="methods">
     <h3>Methods</h3>
     <ul>
       {{#METHODS}}<li><a href="#{{NAME}}">{{NAME}}()</a></li>{{/METHODS}}
@@ -259,7 +329,7 @@ Use the template below:
   </section>
 </article>
 '''
-    elif symbol['type'] == 'typedef':
+    elif sym_type == 'typedef':
         template = '''
 <article class="symbol-doc" id="{NAME}">
   <header>
@@ -280,35 +350,142 @@ Use the template below:
 Provide only the populated HTML code without any extra acknowledgements, markdown formatting, notes, etc. I need raw HTML code.
 """
 
-    full_prompt = prompt_header + template + footer
-    return full_prompt
+    return string.Template(template + footer)
+
+
+def _defs_json(defs, json_cache):
+    """
+    Equivalent to json.dumps(defs, indent=2), but each definition is encoded
+    once per run and reused by every prompt that references it.
+    """
+    parts = []
+    for d in defs:
+        key = (d['type'], d['name'])
+        part = json_cache.get(key)
+        if part is None:
+            part = json_cache[key] = '  ' + json.dumps(d, indent=2).replace('\n', '\n  ')
+        parts.append(part)
+    return '[\n' + ',\n'.join(parts) + '\n]'
+
+
+def build_prompt_for_symbol(symbol, symbol_map, json_cache=None):
+    defs = [symbol]
+    for ref in symbol.get('type_references', []):
+        if ref in symbol_map:
+            defs.append(symbol_map[ref])
+    for field in symbol.get('fields', []):
+        typ = field[1]
+        if typ in symbol_map:
+            defs.append(symbol_map[typ])
+    if symbol['type'] == 'typedef':
+        typ = symbol['underlying']
+        if typ in symbol_map:
+            defs.append(symbol_map[typ])
+    unique_defs = list({d['name']: d for d in defs}.values())
+    defs_json = _defs_json(unique_defs, {} if json_cache is None else json_cache)
+
+    anchor_instructions = (
+        "When mentioning any referenced symbol, wrap its name in an anchor tag linking to its definition, "
+        "e.g., <a href=\"#{NAME}\">{NAME}</a>. Ensure each symbol section has an id matching its name."
+    )
+
+    prompt_header = f"""
+You are an expert C and C++ documentation generator using HTML. Produce detailed and informative HTML documentation to the best of your abilities. If you are inferring something, ensure you show that and do not portray it as fact.
+I will provide a JSON structure which provides an overview of the symbol you must write documentation for.
+
+Context definitions (JSON):
+{defs_json}
+
+Symbol: {symbol['name']} ({symbol['type']})
+
+{anchor_instructions}
+
+Use the template below:
+"""
+
+    return prompt_header + _render_template(symbol['type']).substitute(name=symbol['name'])
+
+
+def stream_documentation(prompt):
+    """
+    Send the given prompt to OpenAI and yield the response as it arrives.
+    Responses are cached, so an identical prompt is only sent once; a cached
+    response is yielded as a single chunk.
+    """
+    model = "gpt-4"
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that generates documentation."},
+        {"role": "user", "content": prompt}
+    ]
+    cached = response_cache.get(model, messages)
+    if cached is not None:
+        yield cached
+        return
+    request_bucket.acquire()
+    stream = get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        stream=True
+    )
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        # Drop leading whitespace, as the non-streamed response was stripped
+        if not parts:
+            delta = delta.lstrip()
+            if not delta:
+                continue
+        parts.append(delta)
+        yield delta
+    response_cache.put(model, messages, ''.join(parts).strip())
+
 
 def send_documentation_prompt(prompt):
     """
     Send the given prompt to OpenAI and return the response.
     """
-    response = openai.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that generates documentation."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0
-    )
-    return response.choices[0].message.content.strip()
+    return ''.join(stream_documentation(prompt)).strip()
+
+
+def _stream_into(prompt, chunks):
+    """
+    Run stream_documentation on a worker thread, forwarding each chunk to
+    the `chunks` queue. An exception is forwarded in place of a chunk, and
+    None marks the end of the response.
+    """
+    try:
+        for chunk in stream_documentation(prompt):
+            chunks.put(chunk)
+    except Exception as e:
+        chunks.put(e)
+    chunks.put(None)
 
 
 def scan_directory(path, clang_args=None, base_dir=None):
     """
     Recursively scan a directory for C/C++ source files and extract symbols.
+    Each file is an independent translation unit, so they are parsed in
+    parallel worker processes; results keep the directory walk order.
     """
-    all_symbols = []
+    paths = []
     for root, dirs, files in os.walk(path):
         for file in files:
             if file.endswith(('.c', '.cpp', '.cc', '.cxx', '.h', '.hpp')):
-                full_path = os.path.join(root, file)
-                syms = extract_symbols_from_file(full_path, clang_args, base_dir=base_dir or path)
-                all_symbols.extend(syms)
+                paths.append(os.path.join(root, file))
+
+    all_symbols = []
+    if not paths:
+        return all_symbols
+    # Windows does not allow more than 61 worker processes
+    workers = min(len(paths), os.cpu_count() or 1, 61)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for syms in executor.map(extract_symbols_from_file, paths, repeat(clang_args), repeat(base_dir or path)):
+            all_symbols.extend(syms)
     return all_symbols
 
 
@@ -326,16 +503,12 @@ def main():
         base_dir = os.path.dirname(os.path.abspath(target))
         symbols = extract_symbols_from_file(target, clang_args, base_dir)
 
-    # Deduplicate symbols by type and name
-    unique = {}
-    for s in symbols:
-        key = (s['type'], s['name'])
-        if key not in unique:
-            unique[key] = s
-    symbols = list(unique.values())
+    # Deduplicate symbols by type and name, keeping first-seen order
+    symbols = list({(s['type'], s['name']): s for s in symbols}.values())
 
     # Build symbol map
     symbol_map = {sym['name']: sym for sym in symbols}
+    json_cache = {}
 
     # Prepare output file and write header + CSS
     output_file = 'documentation.html'
@@ -365,18 +538,36 @@ body { font-family: Arial, sans-serif; margin: 20px; }
 """)
         f.flush()
 
-        for sym in symbols:
-            prompt = build_prompt_for_symbol(sym, symbol_map)
-            print(f"--- Prompt for {sym['name']} ---")
-            print(prompt)
-
-            html = send_documentation_prompt(prompt)
-            print(html)
-            print()
-
-            # Append the returned HTML block and flush immediately
-            f.write(html + "\n")
-            f.flush()
+        # Requests run concurrently on worker threads, each buffering its
+        # chunks in its own queue; symbols are still written in order, with
+        # the current one streamed as it arrives
+        prompts = [build_prompt_for_symbol(sym, symbol_map, json_cache) for sym in symbols]
+        executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS)
+        try:
+            responses = []
+            for prompt in prompts:
+                chunks = queue.Queue()
+                executor.submit(_stream_into, prompt, chunks)
+                responses.append(chunks)
+
+            for sym, prompt, chunks in zip(symbols, prompts, responses):
+                print(f"--- Prompt for {sym['name']} ---")
+                print(prompt)
+
+                # Append the HTML block as it streams in, flushing each chunk
+                for chunk in iter(chunks.get, None):
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    f.write(chunk)
+                    f.flush()
+                    print(chunk, end='', flush=True)
+                print()
+                print()
+
+                f.write("\n")
+                f.flush()
+        finally:
+            executor.shutdown(cancel_futures=True)
 
         # After all symbols, write closing tags
         f.write("""</body>